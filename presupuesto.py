@@ -2,22 +2,45 @@ try:
     import struct
     import os
     import re
+    import zlib
+    import unicodedata
+    from bisect import bisect_left, bisect_right, insort
     from math import ceil
+    from contextlib import contextmanager
+    from heapq import nlargest
+    import operator
     import openpyxl
-    from datetime import datetime
+    from datetime import datetime, date
     import logging
+    import threading
+    import atexit
     from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,
                                  QPushButton, QLabel, QLineEdit, QComboBox, QMessageBox,
                                  QTableWidget, QTableWidgetItem, QHeaderView, QDialog,
-                                 QFormLayout, QDialogButtonBox)
-    from PyQt5.QtCore import Qt
-    from PyQt5.QtGui import QFont
+                                 QFormLayout, QDialogButtonBox, QCompleter, QGridLayout)
+    from PyQt5.QtCore import Qt, QStringListModel
+    from PyQt5.QtGui import QFont, QPainter
     import sys
 except ImportError as e:
     print(f"Error al importar módulos: {e}")
     print("Ejecuta: pip install PyQt5 openpyxl")
     exit(1)
 
+# PyQtChart es opcional: sin él, el resumen se muestra solo como texto
+try:
+    from PyQt5.QtChart import (QChart, QChartView, QLineSeries, QBarSeries, QHorizontalBarSeries,
+                               QBarSet, QBarCategoryAxis, QValueAxis)
+    HAY_GRAFICOS = True
+except ImportError:
+    HAY_GRAFICOS = False
+
+# Bloqueo de archivos entre procesos: fcntl en Linux/macOS, msvcrt en Windows
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
 logging.basicConfig(level=logging.DEBUG)
 
 # Constantes
@@ -30,6 +53,25 @@ CHAPA_ANCHO = 150.0
 CHAPA_ALTO = 300.0
 FILE_NAME = "presupuestos.dat"
 STOCK_FILE = "stock.dat"
+INDICE_CLIENTES_FILE = "clientes.idx"
+INDICE_PRODUCTOS_FILE = "productos.idx"
+INDEXAR_TIPO_CHAPA = True  # incluir las palabras de tipo_chapa en el índice de productos
+MAX_SUGERENCIAS = 10
+INDICES_SUCIO_FILE = "indices.sucio"  # existe mientras se reescribe presupuestos.dat
+GUARDAR_INDICES_CADA = 1000  # registros nuevos que se acumulan antes de volver a guardar los índices
+COMPACT_FILE = "presupuestos.pcf"
+NUMERACION_FILE = "numeracion.dat"  # próximo número a asignar (se bloquea al usarlo)
+NUMEROS_FILE = "numeros.dat"  # mapa de bits de números de presupuesto en uso
+NUMEROS_SIN_CONFIRMAR = 0xFFFFFFFF  # cabecera de numeros.dat mientras hay bits sin sincronizar
+MAX_NUMERO = 9999999
+AGREGADOS_FILE = "agregados.dat"
+MAX_PUNTOS_GRAFICO = 36  # por encima de esto, los meses se agrupan antes de graficar
+TOP_CLIENTES = 10
+LATENCIA_COMMIT = 0.05  # segundos que un presupuesto nuevo puede esperar en memoria antes del fsync
+MAX_PENDIENTES = 64  # al juntar esta cantidad de presupuestos se escriben sin esperar
+TAMAÑO_PAGINA = 100
+RANGOS_DASHBOARD = {"Últimos 12 meses": 12, "Últimos 3 años": 36, "Todo": None}
+REGISTROS_POR_BLOQUE = 4096  # registros por bloque al leer/escribir en bloques grandes
 
 # Estructura para presupuestos (definida antes de cualquier función que la use)
 PRESUPUESTO_STRUCT = f"{MAX_CLIENTE}s i {MAX_FECHA}s {MAX_PRODUCTO}s {MAX_CHAPA}s 7f"
@@ -39,6 +81,150 @@ PRESUPUESTO_SIZE = struct.calcsize(PRESUPUESTO_STRUCT)
 STOCK_STRUCT = "20s d i"  # tipo_chapa (20 chars), espesor (double), cantidad (int)
 STOCK_SIZE = struct.calcsize(STOCK_STRUCT)
 
+# Estructura de los archivos de índice: cabecera y una entrada por clave
+INDICE_MAGIC = b"IDX1"
+INDICE_HEADER_STRUCT = "4s I I"  # magic, registros indexados, cantidad de entradas
+INDICE_HEADER_SIZE = struct.calcsize(INDICE_HEADER_STRUCT)
+INDICE_ENTRADA_STRUCT = "H H I"  # largo clave, largo etiqueta, cantidad de posiciones
+INDICE_ENTRADA_SIZE = struct.calcsize(INDICE_ENTRADA_STRUCT)
+
+# Cabecera de numeros.dat
+NUMEROS_MAGIC = b"NUM1"
+NUMEROS_HEADER_STRUCT = "4s I"  # magic, registros de presupuestos.dat que refleja
+NUMEROS_HEADER_SIZE = struct.calcsize(NUMEROS_HEADER_STRUCT)
+
+# Estructura de agregados.dat (tablas pre-calculadas para el resumen)
+AGREGADOS_MAGIC = b"AGR1"
+AGREGADO_STRUCT = f"B H B {MAX_CLIENTE}s d d i"  # tabla, año, mes, clave, espesor, total, cantidad
+AGREGADO_SIZE = struct.calcsize(AGREGADO_STRUCT)
+AGREGADO_MES, AGREGADO_CHAPA, AGREGADO_CLIENTE = 0, 1, 2
+
+# Formato compacto versionado (presupuestos.pcf), little-endian:
+#   cabecera | diccionario de strings + CRC | bloques (cabecera con CRC + registros)
+# Clientes y tipos de chapa se guardan una sola vez en el diccionario y los registros
+# los referencian por id. La fecha va como día ordinal y los importes en float64.
+COMPACT_MAGIC = b"PCMP"
+COMPACT_VERSION = 1
+COMPACT_HEADER_STRUCT = struct.Struct("<4s H H I I")  # magic, versión, reservado, registros, strings
+COMPACT_STRING_STRUCT = struct.Struct("<B")  # largo del string en el diccionario
+COMPACT_CRC_STRUCT = struct.Struct("<I")
+COMPACT_BLOQUE_STRUCT = struct.Struct("<I I I")  # registros, bytes de datos, CRC32 de los datos
+# cliente_id, numero_cliente, fecha, tipo_chapa_id, espesor, ancho, largo, ganancia,
+# precio_chapa, precio_mano_obra, precio_total, largo del producto (seguido del producto)
+COMPACT_REGISTRO_STRUCT = struct.Struct("<I i I I f f f f d d d B")
+
+# Escritura segura
+# Los archivos se reescriben en un temporal que reemplaza al original con os.replace,
+# así un corte a mitad de camino deja el archivo anterior intacto. Los presupuestos
+# nuevos se juntan en memoria y se agregan a presupuestos.dat en grupo, con un solo
+# fsync, a más tardar LATENCIA_COMMIT segundos después de crearlos.
+
+_pendientes = []  # registros empaquetados que esperan el próximo commit
+_bloqueo_pendientes = threading.RLock()  # también ordena las escrituras del commit y de la interfaz
+_temporizador = None
+
+def _sincronizar_directorio(ruta):
+    """fsync del directorio para que el os.replace sobreviva a un corte (no aplica en Windows)."""
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(ruta)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+@contextmanager
+def escritura_atomica(ruta, sincronizar=True):
+    """Abre un temporal para escribir y al terminar reemplaza ruta de una sola vez.
+
+    Con sincronizar=False se omiten los fsync (para archivos que se pueden reconstruir).
+    """
+    temporal = ruta + ".tmp"
+    with _bloqueo_pendientes:
+        try:
+            with open(temporal, "wb") as f:
+                yield f
+                if sincronizar:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temporal, ruta)
+        except BaseException:
+            if os.path.exists(temporal):
+                os.remove(temporal)
+            raise
+        if sincronizar:
+            _sincronizar_directorio(ruta)
+
+def escribir_registro_agrupado(data):
+    """Encola un registro para agregarlo a presupuestos.dat en el próximo commit.
+
+    Una vez encolado el registro queda aceptado: si el commit falla se registra el error
+    y el registro sigue pendiente hasta el próximo intento.
+    """
+    global _temporizador
+    with _bloqueo_pendientes:
+        _pendientes.append(data)
+        if len(_pendientes) >= MAX_PENDIENTES:
+            _intentar_confirmar()
+        elif _temporizador is None:
+            _temporizador = threading.Timer(LATENCIA_COMMIT, _intentar_confirmar)
+            _temporizador.daemon = True
+            _temporizador.start()
+
+def confirmar_escrituras():
+    """Escribe y sincroniza los registros pendientes, junto con el stock y los índices."""
+    global _temporizador
+    with _bloqueo_pendientes:
+        if _temporizador is not None:
+            _temporizador.cancel()
+            _temporizador = None
+        if _pendientes:
+            with open(FILE_NAME, "ab", buffering=0) as f:
+                inicio = f.seek(0, os.SEEK_END)
+                try:
+                    datos = memoryview(b"".join(_pendientes))
+                    while datos:
+                        datos = datos[f.write(datos):]
+                    os.fsync(f.fileno())
+                except OSError as e:
+                    # Sin esto el próximo intento agregaría los registros detrás de un
+                    # registro a medias y todas las posiciones quedarían corridas
+                    logging.error(f"No se pudieron guardar {len(_pendientes)} presupuestos: {e}")
+                    os.ftruncate(f.fileno(), inicio)
+                    raise
+            _pendientes.clear()
+            # El stock cambia con cada presupuesto nuevo: se guarda una vez por grupo. Los
+            # índices se ponen al día al iniciar leyendo los registros nuevos, así que se
+            # guardan recién cuando se acumularon GUARDAR_INDICES_CADA registros.
+            guardar_stock()
+            if contar_registros() - registros_en_indices >= GUARDAR_INDICES_CADA:
+                guardar_indices(sincronizar=False)
+        # Los números reservados se sincronizan después de los registros que los usan
+        confirmar_numeros()
+
+def _intentar_confirmar():
+    """confirmar_escrituras para commits que no pidió quien llama: el error se registra
+    y los registros quedan pendientes para el próximo commit."""
+    try:
+        confirmar_escrituras()
+    except Exception as e:
+        logging.error(f"Error al confirmar escrituras pendientes: {e}")
+
+def recuperar_archivos():
+    """Al iniciar: borra temporales de escrituras cortadas y quita un último registro incompleto."""
+    for ruta in (FILE_NAME, STOCK_FILE, INDICE_CLIENTES_FILE, INDICE_PRODUCTOS_FILE,
+                 AGREGADOS_FILE, NUMEROS_FILE):
+        if os.path.exists(ruta + ".tmp"):
+            os.remove(ruta + ".tmp")
+    if os.path.exists(FILE_NAME):
+        tamaño = os.path.getsize(FILE_NAME)
+        sobrante = tamaño % PRESUPUESTO_SIZE
+        if sobrante:
+            logging.warning(f"{FILE_NAME}: se descartan {sobrante} bytes de un registro incompleto")
+            with open(FILE_NAME, "r+b") as f:
+                f.truncate(tamaño - sobrante)
+                os.fsync(f.fileno())
+
 # Stock inicial
 stock = [
     {"tipo_chapa": "Comun", "espesor": 1.5, "cantidad": 10},
@@ -65,7 +251,7 @@ def cargar_stock():
 
 def guardar_stock():
     """Guarda el stock actual en el archivo stock.dat."""
-    with open(STOCK_FILE, "wb") as f:
+    with escritura_atomica(STOCK_FILE) as f:
         for item in stock:
             tipo_chapa = item["tipo_chapa"].encode().ljust(20, b"\0")
             f.write(struct.pack(STOCK_STRUCT, tipo_chapa, item["espesor"], item["cantidad"]))
@@ -97,8 +283,7 @@ def validar_stock(tipo_chapa, espesor, chapas_necesarias):
     for item in stock:
         if item["tipo_chapa"] == tipo_chapa and item["espesor"] == espesor:
             if item["cantidad"] >= chapas_necesarias:
-                item["cantidad"] -= chapas_necesarias
-                guardar_stock()  # Actualizar el archivo stock.dat
+                item["cantidad"] -= chapas_necesarias  # stock.dat se guarda al confirmar el presupuesto
                 return True
             return False
     return False
@@ -137,8 +322,9 @@ def crear_presupuesto(datos):
 
     try:
         numero_cliente = int(datos["numero_cliente"])
-        existing = buscar_por_numero(numero_cliente)
-        if existing:
+        if numero_cliente > MAX_NUMERO:
+            errors.append(f"Número de cliente debe ser menor o igual a {MAX_NUMERO}")
+        elif numero_en_uso(numero_cliente):
             errors.append(f"El número de cliente {numero_cliente} ya existe. Use un número diferente.")
     except (ValueError, TypeError) as e:
         errors.append("Número de cliente no válido")
@@ -161,32 +347,26 @@ def crear_presupuesto(datos):
     chapas_y = ceil(datos["largo"] / CHAPA_ALTO)
     total_chapas = chapas_x * chapas_y
 
-    if not validar_stock(datos["tipo_chapa"], datos["espesor"], total_chapas):
-        return {"success": False, "error": f"Stock insuficiente para {datos['tipo_chapa']} ({datos['espesor']} mm)"}
-
     costo_base = (total_chapas * datos["precio_chapa"]) + datos["precio_mano_obra"]
     precio_total = costo_base * (1 + datos["ganancia"] / 100)
     datos["precio_total"] = precio_total
 
     try:
-        with open(FILE_NAME, "ab") as f:
-            cliente = datos["cliente"].encode().ljust(MAX_CLIENTE, b"\0")
-            fecha = datos["fecha"].encode().ljust(MAX_FECHA, b"\0")
-            producto = datos["producto"].encode().ljust(MAX_PRODUCTO, b"\0")
-            tipo_chapa = datos["tipo_chapa"].encode().ljust(MAX_CHAPA, b"\0")
-            f.write(struct.pack(PRESUPUESTO_STRUCT,
-                               cliente,
-                               datos["numero_cliente"],
-                               fecha,
-                               producto,
-                               tipo_chapa,
-                               datos["espesor"],
-                               datos["ancho"],
-                               datos["largo"],
-                               datos["precio_chapa"],
-                               datos["precio_mano_obra"],
-                               datos["ganancia"],
-                               datos["precio_total"]))
+        # El número se reserva y el registro se encola sin soltar el bloqueo, para que
+        # ningún commit intermedio confirme numeros.dat con la reserva pero sin el registro
+        with _bloqueo_pendientes:
+            if not reservar_numero(datos["numero_cliente"]):
+                return {"success": False, "error": f"El número de cliente {datos['numero_cliente']} ya existe. Use un número diferente."}
+
+            if not validar_stock(datos["tipo_chapa"], datos["espesor"], total_chapas):
+                liberar_numero(datos["numero_cliente"])
+                return {"success": False, "error": f"Stock insuficiente para {datos['tipo_chapa']} ({datos['espesor']} mm)"}
+
+            posicion = contar_registros()
+            registro = empaquetar_presupuesto(datos)
+            # Se indexa lo que se va a leer del disco (importes en float32), igual que al reconstruir
+            indexar_presupuesto(desempaquetar_presupuesto(registro), posicion)
+            escribir_registro_agrupado(registro)
 
         # Guardar en una carpeta por cliente con archivo Excel
         cliente = datos["cliente"].strip()
@@ -220,53 +400,912 @@ def crear_presupuesto(datos):
     except Exception as e:
         return {"success": False, "error": f"Error al guardar: {str(e)}"}
 
-def leer_presupuestos():
+def empaquetar_presupuesto(p):
+    """Convierte un presupuesto (dict) en un registro binario de tamaño fijo."""
+    cliente = p["cliente"].encode().ljust(MAX_CLIENTE, b"\0")
+    fecha = p["fecha"].encode().ljust(MAX_FECHA, b"\0")
+    producto = p["producto"].encode().ljust(MAX_PRODUCTO, b"\0")
+    tipo_chapa = p["tipo_chapa"].encode().ljust(MAX_CHAPA, b"\0")
+    return struct.pack(PRESUPUESTO_STRUCT,
+                       cliente,
+                       p["numero_cliente"],
+                       fecha,
+                       producto,
+                       tipo_chapa,
+                       p["espesor"],
+                       p["ancho"],
+                       p["largo"],
+                       p["precio_chapa"],
+                       p["precio_mano_obra"],
+                       p["ganancia"],
+                       p["precio_total"])
+
+def desempaquetar_presupuesto(data):
+    """Convierte un registro binario de tamaño fijo en un presupuesto (dict)."""
+    return _presupuesto_desde_tupla(struct.unpack(PRESUPUESTO_STRUCT, data))
+
+def _presupuesto_desde_tupla(unpacked):
+    return {
+        "cliente": unpacked[0].decode().rstrip("\0"),
+        "numero_cliente": unpacked[1],
+        "fecha": unpacked[2].decode().rstrip("\0"),
+        "producto": unpacked[3].decode().rstrip("\0"),
+        "tipo_chapa": unpacked[4].decode().rstrip("\0"),
+        "espesor": unpacked[5],
+        "ancho": unpacked[6],
+        "largo": unpacked[7],
+        "precio_chapa": unpacked[8],
+        "precio_mano_obra": unpacked[9],
+        "ganancia": unpacked[10],
+        "precio_total": unpacked[11]
+    }
+
+def leer_presupuestos(ruta=FILE_NAME):
+    confirmar_escrituras()
     presupuestos = []
-    if os.path.exists(FILE_NAME):
-        with open(FILE_NAME, "rb") as f:
+    if os.path.exists(ruta):
+        with open(ruta, "rb") as f:
             while True:
-                data = f.read(PRESUPUESTO_SIZE)
-                if not data:
+                # Leer de a muchos registros por vez en lugar de uno por llamada
+                data = f.read(PRESUPUESTO_SIZE * REGISTROS_POR_BLOQUE)
+                completos = len(data) - len(data) % PRESUPUESTO_SIZE
+                for unpacked in struct.iter_unpack(PRESUPUESTO_STRUCT, data[:completos]):
+                    presupuestos.append(_presupuesto_desde_tupla(unpacked))
+                if len(data) < PRESUPUESTO_SIZE * REGISTROS_POR_BLOQUE:
                     break
-                unpacked = struct.unpack(PRESUPUESTO_STRUCT, data)
-                presupuestos.append({
-                    "cliente": unpacked[0].decode().rstrip("\0"),
-                    "numero_cliente": unpacked[1],
-                    "fecha": unpacked[2].decode().rstrip("\0"),
-                    "producto": unpacked[3].decode().rstrip("\0"),
-                    "tipo_chapa": unpacked[4].decode().rstrip("\0"),
-                    "espesor": unpacked[5],
-                    "ancho": unpacked[6],
-                    "largo": unpacked[7],
-                    "precio_chapa": unpacked[8],
-                    "precio_mano_obra": unpacked[9],
-                    "ganancia": unpacked[10],
-                    "precio_total": unpacked[11]
-                })
     return presupuestos
 
+def contar_registros():
+    """Cantidad de registros en presupuestos.dat, contando los que esperan el commit."""
+    with _bloqueo_pendientes:
+        en_disco = os.path.getsize(FILE_NAME) // PRESUPUESTO_SIZE if os.path.exists(FILE_NAME) else 0
+        return en_disco + len(_pendientes)
+
+def leer_presupuestos_en(posiciones):
+    """Lee solo los registros indicados (posición = número de registro en el archivo)."""
+    confirmar_escrituras()
+    presupuestos = []
+    if posiciones and os.path.exists(FILE_NAME):
+        with open(FILE_NAME, "rb") as f:
+            for posicion in posiciones:
+                f.seek(posicion * PRESUPUESTO_SIZE)
+                data = f.read(PRESUPUESTO_SIZE)
+                if len(data) == PRESUPUESTO_SIZE:
+                    presupuestos.append(desempaquetar_presupuesto(data))
+    return presupuestos
+
+# Índices persistentes
+# Cada índice asocia una clave a la lista ordenada de posiciones de registro en
+# presupuestos.dat. Se guarda junto con la cantidad de registros indexados. Como los
+# presupuestos nuevos solo se agregan al final, el mismo archivo de datos hace de
+# registro de cambios: al cargar se indexan los registros posteriores a esa cantidad.
+# Si el índice cubre más registros que el archivo, se reconstruye con una lectura completa.
+
+registros_en_indices = 0  # registros cubiertos por los índices guardados en disco
+
+def normalizar_texto(texto):
+    """Pasa a minúsculas, quita acentos y espacios repetidos ("Peña  Hnos" -> "pena hnos")."""
+    descompuesto = unicodedata.normalize("NFKD", texto)
+    sin_acentos = "".join(c for c in descompuesto if not unicodedata.combining(c))
+    return " ".join(sin_acentos.casefold().split())
+
+def _guardar_indice(ruta, num_registros, entradas, sincronizar=True):
+    """Guarda una lista de (clave, etiqueta, posiciones) en un archivo de índice."""
+    with escritura_atomica(ruta, sincronizar) as f:
+        f.write(struct.pack(INDICE_HEADER_STRUCT, INDICE_MAGIC, num_registros, len(entradas)))
+        for clave, etiqueta, posiciones in entradas:
+            clave_bytes = clave.encode()
+            etiqueta_bytes = etiqueta.encode()
+            f.write(struct.pack(INDICE_ENTRADA_STRUCT, len(clave_bytes), len(etiqueta_bytes), len(posiciones)))
+            f.write(clave_bytes)
+            f.write(etiqueta_bytes)
+            f.write(struct.pack(f"{len(posiciones)}I", *posiciones))
+
+def _cargar_indice(ruta, num_registros):
+    """Lee un archivo de índice y devuelve (registros cubiertos, entradas).
+
+    Devuelve None si no existe, está dañado o cubre más registros que num_registros.
+    """
+    if not os.path.exists(ruta):
+        return None
+    try:
+        with open(ruta, "rb") as f:
+            data = f.read()
+        magic, registros, cantidad = struct.unpack_from(INDICE_HEADER_STRUCT, data, 0)
+        if magic != INDICE_MAGIC or registros > num_registros:
+            return None
+        entradas = []
+        offset = INDICE_HEADER_SIZE
+        for _ in range(cantidad):
+            largo_clave, largo_etiqueta, n = struct.unpack_from(INDICE_ENTRADA_STRUCT, data, offset)
+            offset += INDICE_ENTRADA_SIZE
+            clave = data[offset:offset + largo_clave].decode()
+            offset += largo_clave
+            etiqueta = data[offset:offset + largo_etiqueta].decode()
+            offset += largo_etiqueta
+            posiciones = list(struct.unpack_from(f"{n}I", data, offset))
+            offset += 4 * n
+            entradas.append((clave, etiqueta, posiciones))
+        return registros, entradas
+    except (struct.error, UnicodeDecodeError) as e:
+        logging.warning(f"Índice {ruta} dañado, se reconstruye: {e}")
+        return None
+
+def _presupuestos_desde(inicio):
+    """(posición, presupuesto) de los registros a partir de inicio."""
+    confirmar_escrituras()
+    if not os.path.exists(FILE_NAME):
+        return
+    with open(FILE_NAME, "rb") as f:
+        f.seek(inicio * PRESUPUESTO_SIZE)
+        data = f.read()
+    completos = len(data) - len(data) % PRESUPUESTO_SIZE
+    for posicion, unpacked in enumerate(struct.iter_unpack(PRESUPUESTO_STRUCT, data[:completos]), inicio):
+        yield posicion, _presupuesto_desde_tupla(unpacked)
+
+def _quitar_posicion(posiciones, posicion):
+    i = bisect_left(posiciones, posicion)
+    if i < len(posiciones) and posiciones[i] == posicion:
+        del posiciones[i]
+
+def _desplazar_posiciones(posiciones, posicion):
+    """Corrige las posiciones posteriores a un registro eliminado."""
+    for i in range(bisect_right(posiciones, posicion), len(posiciones)):
+        posiciones[i] -= 1
+
+# Índice de clientes: nombre normalizado -> {"nombre": nombre original, "posiciones": [...]}
+indice_clientes = {}
+claves_clientes = []  # claves ordenadas, para buscar por prefijo
+
+def indexar_cliente(nombre, posicion):
+    clave = normalizar_texto(nombre)
+    entrada = indice_clientes.get(clave)
+    if entrada is None:
+        entrada = indice_clientes[clave] = {"nombre": nombre.strip(), "posiciones": []}
+        insort(claves_clientes, clave)
+    insort(entrada["posiciones"], posicion)
+
+def desindexar_cliente(nombre, posicion):
+    clave = normalizar_texto(nombre)
+    entrada = indice_clientes.get(clave)
+    if entrada is None:
+        return
+    _quitar_posicion(entrada["posiciones"], posicion)
+    if not entrada["posiciones"]:
+        del indice_clientes[clave]
+        del claves_clientes[bisect_left(claves_clientes, clave)]
+
+def desplazar_indice_clientes(posicion):
+    for entrada in indice_clientes.values():
+        _desplazar_posiciones(entrada["posiciones"], posicion)
+
+def reconstruir_indice_clientes():
+    indice_clientes.clear()
+    claves_clientes.clear()
+    for posicion, p in enumerate(leer_presupuestos()):
+        indexar_cliente(p["cliente"], posicion)
+
+def guardar_indice_clientes(sincronizar=True):
+    entradas = [(clave, indice_clientes[clave]["nombre"], indice_clientes[clave]["posiciones"])
+                for clave in claves_clientes]
+    _guardar_indice(INDICE_CLIENTES_FILE, contar_registros(), entradas, sincronizar)
+
+def cargar_indice_clientes():
+    """Carga clientes.idx y lo pone al día. Devuelve los registros que cubría el archivo (-1 si se reconstruyó)."""
+    cargado = _cargar_indice(INDICE_CLIENTES_FILE, contar_registros())
+    if cargado is None:
+        reconstruir_indice_clientes()
+        return -1
+    registros, entradas = cargado
+    indice_clientes.clear()
+    claves_clientes.clear()
+    for clave, nombre, posiciones in entradas:
+        indice_clientes[clave] = {"nombre": nombre, "posiciones": posiciones}
+        claves_clientes.append(clave)
+    for posicion, p in _presupuestos_desde(registros):
+        indexar_cliente(p["cliente"], posicion)
+    return registros
+
+# Índice invertido de productos: palabra normalizada -> posiciones de los registros que la contienen
+
+indice_productos = {}
+
+def tokenizar(texto):
+    """Separa un texto en palabras normalizadas ("Portón corredizo" -> ["porton", "corredizo"])."""
+    return re.findall(r"[a-z0-9]+", normalizar_texto(texto))
+
+def _palabras_presupuesto(p):
+    texto = f"{p['producto']} {p['tipo_chapa']}" if INDEXAR_TIPO_CHAPA else p["producto"]
+    return set(tokenizar(texto))
+
+def indexar_producto(p, posicion):
+    for palabra in _palabras_presupuesto(p):
+        insort(indice_productos.setdefault(palabra, []), posicion)
+
+def desindexar_producto(p, posicion):
+    for palabra in _palabras_presupuesto(p):
+        posiciones = indice_productos.get(palabra)
+        if posiciones is None:
+            continue
+        _quitar_posicion(posiciones, posicion)
+        if not posiciones:
+            del indice_productos[palabra]
+
+def desplazar_indice_productos(posicion):
+    for posiciones in indice_productos.values():
+        _desplazar_posiciones(posiciones, posicion)
+
+def reconstruir_indice_productos():
+    indice_productos.clear()
+    for posicion, p in enumerate(leer_presupuestos()):
+        indexar_producto(p, posicion)
+
+def guardar_indice_productos(sincronizar=True):
+    entradas = [(palabra, "", posiciones) for palabra, posiciones in indice_productos.items()]
+    _guardar_indice(INDICE_PRODUCTOS_FILE, contar_registros(), entradas, sincronizar)
+
+def cargar_indice_productos():
+    """Carga productos.idx y lo pone al día. Devuelve los registros que cubría el archivo (-1 si se reconstruyó)."""
+    cargado = _cargar_indice(INDICE_PRODUCTOS_FILE, contar_registros())
+    if cargado is None:
+        reconstruir_indice_productos()
+        return -1
+    registros, entradas = cargado
+    indice_productos.clear()
+    for palabra, _, posiciones in entradas:
+        indice_productos[palabra] = posiciones
+    for posicion, p in _presupuestos_desde(registros):
+        indexar_producto(p, posicion)
+    return registros
+
+def _intersectar(listas):
+    """Intersección de listas ordenadas, recorriendo la más corta y buscando en las demás."""
+    listas = sorted(listas, key=len)
+    resultado = []
+    for posicion in listas[0]:
+        for otra in listas[1:]:
+            i = bisect_left(otra, posicion)
+            if i == len(otra) or otra[i] != posicion:
+                break
+        else:
+            resultado.append(posicion)
+    return resultado
+
+def buscar_posiciones_por_producto(consulta):
+    """Posiciones de los registros que contienen todas las palabras de la consulta."""
+    palabras = set(tokenizar(consulta))
+    if not palabras:
+        return []
+    listas = []
+    for palabra in palabras:
+        posiciones = indice_productos.get(palabra)
+        if not posiciones:
+            return []
+        listas.append(posiciones)
+    return _intersectar(listas)
+
+def buscar_por_producto(consulta):
+    return leer_presupuestos_en(buscar_posiciones_por_producto(consulta))
+
+# Agregados para el resumen
+# Totales por mes, chapas consumidas por mes/tipo/espesor y totales por cliente. Se
+# actualizan en cada alta, modificación o baja, así el resumen no lee presupuestos.dat.
+
+agregados_mes = {}  # (año, mes) -> {"total": ..., "cantidad": ...}
+agregados_chapas = {}  # (año, mes, tipo_chapa, espesor) -> chapas
+agregados_clientes = {}  # cliente normalizado -> {"nombre": ..., "total": ..., "cantidad": ...}
+
+def calcular_chapas(ancho, largo):
+    return ceil(ancho / CHAPA_ANCHO) * ceil(largo / CHAPA_ALTO)
+
+def sumar_agregados(p, signo=1):
+    """Suma (signo=1) o resta (signo=-1) un presupuesto de las tablas de agregados."""
+    clave = normalizar_texto(p["cliente"])
+    cliente = agregados_clientes.setdefault(clave, {"nombre": p["cliente"].strip(), "total": 0.0, "cantidad": 0})
+    cliente["total"] += signo * p["precio_total"]
+    cliente["cantidad"] += signo
+    if cliente["cantidad"] <= 0:
+        del agregados_clientes[clave]
+    try:
+        fecha = datetime.strptime(p["fecha"], "%d/%m/%Y")
+    except ValueError:
+        return
+    mes = agregados_mes.setdefault((fecha.year, fecha.month), {"total": 0.0, "cantidad": 0})
+    mes["total"] += signo * p["precio_total"]
+    mes["cantidad"] += signo
+    if mes["cantidad"] <= 0:
+        del agregados_mes[(fecha.year, fecha.month)]
+    clave_chapa = (fecha.year, fecha.month, p["tipo_chapa"], round(p["espesor"], 2))
+    chapas = agregados_chapas.get(clave_chapa, 0) + signo * calcular_chapas(p["ancho"], p["largo"])
+    if chapas > 0:
+        agregados_chapas[clave_chapa] = chapas
+    else:
+        agregados_chapas.pop(clave_chapa, None)
+
+def reconstruir_agregados():
+    agregados_mes.clear()
+    agregados_chapas.clear()
+    agregados_clientes.clear()
+    for p in leer_presupuestos():
+        sumar_agregados(p)
+
+def guardar_agregados(sincronizar=True):
+    filas = len(agregados_mes) + len(agregados_chapas) + len(agregados_clientes)
+    with escritura_atomica(AGREGADOS_FILE, sincronizar) as f:
+        f.write(struct.pack(INDICE_HEADER_STRUCT, AGREGADOS_MAGIC, contar_registros(), filas))
+        for (año, mes), valores in agregados_mes.items():
+            f.write(struct.pack(AGREGADO_STRUCT, AGREGADO_MES, año, mes, b"", 0.0, valores["total"], valores["cantidad"]))
+        for (año, mes, tipo_chapa, espesor), chapas in agregados_chapas.items():
+            f.write(struct.pack(AGREGADO_STRUCT, AGREGADO_CHAPA, año, mes, tipo_chapa.encode(), espesor, 0.0, chapas))
+        for valores in agregados_clientes.values():
+            f.write(struct.pack(AGREGADO_STRUCT, AGREGADO_CLIENTE, 0, 0, valores["nombre"].encode(),
+                                0.0, valores["total"], valores["cantidad"]))
+
+def cargar_agregados():
+    """Carga agregados.dat y lo pone al día. Devuelve los registros que cubría el archivo (-1 si se reconstruyó)."""
+    try:
+        with open(AGREGADOS_FILE, "rb") as f:
+            data = f.read()
+        magic, registros, filas = struct.unpack_from(INDICE_HEADER_STRUCT, data, 0)
+        if magic != AGREGADOS_MAGIC or registros > contar_registros():
+            raise ValueError("agregados desactualizados")
+        agregados_mes.clear()
+        agregados_chapas.clear()
+        agregados_clientes.clear()
+        for tabla, año, mes, clave, espesor, total, cantidad in struct.iter_unpack(
+                AGREGADO_STRUCT, data[INDICE_HEADER_SIZE:INDICE_HEADER_SIZE + filas * AGREGADO_SIZE]):
+            clave = clave.decode().rstrip("\0")
+            if tabla == AGREGADO_MES:
+                agregados_mes[(año, mes)] = {"total": total, "cantidad": cantidad}
+            elif tabla == AGREGADO_CHAPA:
+                agregados_chapas[(año, mes, clave, espesor)] = cantidad
+            else:
+                agregados_clientes[normalizar_texto(clave)] = {"nombre": clave, "total": total, "cantidad": cantidad}
+    except (OSError, ValueError, struct.error, UnicodeDecodeError):
+        reconstruir_agregados()
+        return -1
+    for _, p in _presupuestos_desde(registros):
+        sumar_agregados(p)
+    return registros
+
+def _rango_meses(meses_atras):
+    """Primer y último (año, mes) a mostrar; meses_atras=None es todo el historial."""
+    if not agregados_mes:
+        return None, None
+    hoy = datetime.now()
+    hasta = max(max(agregados_mes), (hoy.year, hoy.month))
+    if meses_atras is None:
+        return min(agregados_mes), hasta
+    indice = hasta[0] * 12 + hasta[1] - meses_atras
+    return (indice // 12, indice % 12 + 1), hasta
+
+def serie_mensual(meses_atras=None):
+    """Lista de ("mm/aaaa", total, cantidad) con un punto por mes, incluidos los meses sin ventas."""
+    desde, hasta = _rango_meses(meses_atras)
+    if desde is None:
+        return []
+    serie = []
+    for indice in range(desde[0] * 12 + desde[1] - 1, hasta[0] * 12 + hasta[1]):
+        año, mes = indice // 12, indice % 12 + 1
+        valores = agregados_mes.get((año, mes), {"total": 0.0, "cantidad": 0})
+        serie.append((f"{mes:02d}/{año}", valores["total"], valores["cantidad"]))
+    return serie
+
+def reducir_serie(serie, max_puntos=MAX_PUNTOS_GRAFICO):
+    """Agrupa meses consecutivos para que la serie no supere max_puntos."""
+    if len(serie) <= max_puntos:
+        return serie
+    paso = ceil(len(serie) / max_puntos)
+    reducida = []
+    for inicio in range(0, len(serie), paso):
+        grupo = serie[inicio:inicio + paso]
+        etiqueta = grupo[0][0] if len(grupo) == 1 else f"{grupo[0][0]}-{grupo[-1][0]}"
+        reducida.append((etiqueta, sum(g[1] for g in grupo), sum(g[2] for g in grupo)))
+    return reducida
+
+def chapas_por_tipo(meses_atras=None):
+    """Chapas consumidas por (tipo_chapa, espesor) en el rango."""
+    desde, hasta = _rango_meses(meses_atras)
+    resultado = {}
+    for (año, mes, tipo_chapa, espesor), chapas in agregados_chapas.items():
+        if desde <= (año, mes) <= hasta:
+            resultado[(tipo_chapa, espesor)] = resultado.get((tipo_chapa, espesor), 0) + chapas
+    return resultado
+
+def top_clientes(n=TOP_CLIENTES):
+    return nlargest(n, agregados_clientes.values(), key=lambda c: c["total"])
+
+# Operaciones sobre todos los índices
+
+def indexar_presupuesto(p, posicion):
+    indexar_cliente(p["cliente"], posicion)
+    indexar_producto(p, posicion)
+    sumar_agregados(p)
+
+def desindexar_presupuesto(p, posicion):
+    desindexar_cliente(p["cliente"], posicion)
+    desindexar_producto(p, posicion)
+    sumar_agregados(p, -1)
+
+def desplazar_indices(posicion):
+    desplazar_indice_clientes(posicion)
+    desplazar_indice_productos(posicion)
+
+def guardar_indices(sincronizar=True):
+    global registros_en_indices
+    guardar_indice_clientes(sincronizar)
+    guardar_indice_productos(sincronizar)
+    guardar_agregados(sincronizar)
+    registros_en_indices = contar_registros()
+
+def reconstruir_indices():
+    reconstruir_indice_clientes()
+    reconstruir_indice_productos()
+    reconstruir_agregados()
+    reconstruir_numeros()
+
+@contextmanager
+def reescritura_presupuestos():
+    """Envuelve una reescritura de presupuestos.dat que no cambia (o no solo cambia) su largo.
+
+    Mientras dura queda indices.sucio en disco. Si el programa se corta antes de guardar
+    los índices, al iniciar se reconstruyen en lugar de usar archivos que ya no coinciden.
+    """
+    with escritura_atomica(INDICES_SUCIO_FILE) as f:
+        f.write(b"\0")
+    yield
+    guardar_indices()
+    confirmar_numeros()
+    os.remove(INDICES_SUCIO_FILE)
+    _sincronizar_directorio(INDICES_SUCIO_FILE)
+
+def cargar_indices():
+    global registros_en_indices
+    if os.path.exists(INDICES_SUCIO_FILE):
+        logging.warning("Reescritura de presupuestos.dat interrumpida: se reconstruyen los índices")
+        reconstruir_indices()
+        guardar_indices()
+        os.remove(INDICES_SUCIO_FILE)
+        return
+    cubiertos = min(cargar_indice_clientes(), cargar_indice_productos(), cargar_agregados())
+    if cubiertos != contar_registros():
+        guardar_indices()
+    else:
+        registros_en_indices = cubiertos
+    cargar_numeros()
+
+def cerrar_archivos():
+    """Al salir: confirma los presupuestos pendientes y guarda los índices si quedaron atrasados."""
+    confirmar_escrituras()
+    if registros_en_indices != contar_registros():
+        guardar_indices()
+
+def sugerir_clientes(prefijo, limite=MAX_SUGERENCIAS):
+    """Nombres de clientes que empiezan con el prefijo (sin importar mayúsculas ni acentos)."""
+    clave = normalizar_texto(prefijo)
+    if not clave:
+        return []
+    sugerencias = []
+    i = bisect_left(claves_clientes, clave)
+    while i < len(claves_clientes) and len(sugerencias) < limite and claves_clientes[i].startswith(clave):
+        sugerencias.append(indice_clientes[claves_clientes[i]]["nombre"])
+        i += 1
+    return sugerencias
+
+# Numeración de presupuestos
+# numeracion.dat guarda el próximo número sugerido y sirve de bloqueo entre procesos.
+# numeros.dat es un mapa de bits (bit n = número n en uso), así que verificar o
+# reservar un número lee y escribe un solo byte. La cabecera guarda cuántos registros
+# de presupuestos.dat refleja, igual que los índices; mientras hay una reserva que
+# todavía no llegó a disco guarda NUMEROS_SIN_CONFIRMAR. Si al iniciar no coincide
+# con el archivo de datos se pone al día o se reconstruye.
+
+_numeros_sin_confirmar = False  # este proceso cambió bits que aún no se sincronizaron
+
+@contextmanager
+def _bloqueo_numeracion():
+    """Abre numeracion.dat con un bloqueo exclusivo, compartido entre procesos."""
+    with open(NUMERACION_FILE, "a+b") as f:
+        f.seek(0)
+        if fcntl:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        try:
+            yield f
+        finally:
+            if fcntl:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            else:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+def _leer_siguiente(f):
+    f.seek(0)
+    data = f.read(4)
+    return struct.unpack("I", data)[0] if len(data) == 4 else 1
+
+def _escribir_siguiente(f, siguiente):
+    f.seek(0)
+    f.truncate()
+    f.write(struct.pack("I", siguiente))
+    f.flush()
+
+def _leer_bit(bm, numero):
+    bm.seek(NUMEROS_HEADER_SIZE + numero // 8)
+    byte = bm.read(1)
+    return bool(byte) and bool(byte[0] >> (numero % 8) & 1)
+
+def _escribir_bit(bm, numero, usado):
+    bm.seek(NUMEROS_HEADER_SIZE + numero // 8)
+    byte = bm.read(1)
+    valor = byte[0] if byte else 0
+    valor = valor | (1 << numero % 8) if usado else valor & ~(1 << numero % 8)
+    bm.seek(NUMEROS_HEADER_SIZE + numero // 8)
+    bm.write(bytes([valor]))
+
+def _leer_cabecera_numeros(bm):
+    """Registros que refleja numeros.dat, o None si no tiene una cabecera válida."""
+    bm.seek(0)
+    data = bm.read(NUMEROS_HEADER_SIZE)
+    if len(data) < NUMEROS_HEADER_SIZE:
+        return None
+    magic, registros = struct.unpack(NUMEROS_HEADER_STRUCT, data)
+    return registros if magic == NUMEROS_MAGIC else None
+
+def _escribir_cabecera_numeros(bm, registros):
+    bm.seek(0)
+    bm.write(struct.pack(NUMEROS_HEADER_STRUCT, NUMEROS_MAGIC, registros))
+
+def numeros_al_dia():
+    """True si numeros.dat refleja todos los registros de presupuestos.dat."""
+    if not os.path.exists(NUMEROS_FILE):
+        return False
+    with open(NUMEROS_FILE, "rb") as bm:
+        registros = _leer_cabecera_numeros(bm)
+    if registros == NUMEROS_SIN_CONFIRMAR:
+        return _numeros_sin_confirmar
+    return registros == contar_registros()
+
+def _asegurar_numeros():
+    # Fuera de _bloqueo_numeracion: reconstruir_numeros toma primero _bloqueo_pendientes
+    if not numeros_al_dia():
+        logging.warning("numeros.dat no coincide con presupuestos.dat: se reconstruye")
+        reconstruir_numeros()
+
+def _marcar_numero(numero, usado):
+    """Cambia un bit dejando la cabecera en NUMEROS_SIN_CONFIRMAR hasta el próximo commit."""
+    global _numeros_sin_confirmar
+    with open(NUMEROS_FILE, "r+b") as bm:
+        if not _numeros_sin_confirmar:
+            _escribir_cabecera_numeros(bm, NUMEROS_SIN_CONFIRMAR)
+            bm.flush()
+            os.fsync(bm.fileno())
+            _numeros_sin_confirmar = True
+        _escribir_bit(bm, numero, usado)
+
+def confirmar_numeros():
+    """Sincroniza numeros.dat y vuelve a anotar en la cabecera los registros que refleja."""
+    global _numeros_sin_confirmar
+    if not _numeros_sin_confirmar:
+        return
+    with _bloqueo_pendientes, _bloqueo_numeracion(), open(NUMEROS_FILE, "r+b") as bm:
+        bm.flush()
+        os.fsync(bm.fileno())
+        _escribir_cabecera_numeros(bm, contar_registros())
+        bm.flush()
+        os.fsync(bm.fileno())
+        _numeros_sin_confirmar = False
+
+def numero_en_uso(numero):
+    if not (1 <= numero <= MAX_NUMERO) or not os.path.exists(NUMEROS_FILE):
+        return False
+    with open(NUMEROS_FILE, "rb") as bm:
+        return _leer_bit(bm, numero)
+
+def proximo_numero():
+    """Próximo número libre a partir del contador, salteando los cargados a mano."""
+    _asegurar_numeros()
+    with _bloqueo_numeracion() as f, open(NUMEROS_FILE, "rb") as bm:
+        siguiente = _leer_siguiente(f)
+        inicial = siguiente
+        while siguiente <= MAX_NUMERO and _leer_bit(bm, siguiente):
+            siguiente += 1
+        if siguiente != inicial:
+            _escribir_siguiente(f, siguiente)
+        return siguiente
+
+def reservar_numero(numero):
+    """Marca el número como usado. Devuelve False si ya estaba en uso o fuera de rango."""
+    if not (1 <= numero <= MAX_NUMERO):
+        return False
+    _asegurar_numeros()
+    with _bloqueo_numeracion() as f:
+        if numero_en_uso(numero):
+            return False
+        _marcar_numero(numero, True)
+        if numero == _leer_siguiente(f):
+            _escribir_siguiente(f, numero + 1)
+        return True
+
+def liberar_numero(numero):
+    if not (1 <= numero <= MAX_NUMERO):
+        return
+    with _bloqueo_numeracion():
+        _marcar_numero(numero, False)
+
+def reconstruir_numeros():
+    """Marca en numeros.dat todos los números de presupuestos.dat.
+
+    Los bits que ya estaban marcados se conservan: pueden ser reservas de otro proceso
+    cuyo registro todavía no llegó al archivo de datos. Solo si la cabecera no es válida
+    se arma el mapa desde cero.
+    """
+    global _numeros_sin_confirmar
+    # Mismo orden de bloqueos que confirmar_escrituras -> confirmar_numeros
+    with _bloqueo_pendientes, _bloqueo_numeracion():
+        presupuestos = leer_presupuestos()
+        bits = bytearray()
+        if os.path.exists(NUMEROS_FILE):
+            with open(NUMEROS_FILE, "rb") as bm:
+                if _leer_cabecera_numeros(bm) is not None:
+                    bits.extend(bm.read())
+        for p in presupuestos:
+            numero = p["numero_cliente"]
+            if not (1 <= numero <= MAX_NUMERO):
+                logging.warning(f"Número de presupuesto fuera de rango: {numero}")
+                continue
+            if numero // 8 >= len(bits):
+                bits.extend(bytes(numero // 8 + 1 - len(bits)))
+            bits[numero // 8] |= 1 << numero % 8
+        with escritura_atomica(NUMEROS_FILE) as bm:
+            _escribir_cabecera_numeros(bm, len(presupuestos))
+            bm.write(bits)
+        _numeros_sin_confirmar = False
+
+def cargar_numeros():
+    """Verifica numeros.dat contra presupuestos.dat al iniciar.
+
+    Si le faltan registros del final los marca; si la cabecera no es válida, hay una
+    reserva sin confirmar o refleja más registros que el archivo, lo reconstruye.
+    """
+    global _numeros_sin_confirmar
+    registros = None
+    if os.path.exists(NUMEROS_FILE):
+        with open(NUMEROS_FILE, "rb") as bm:
+            registros = _leer_cabecera_numeros(bm)
+    total = contar_registros()
+    if registros == total:
+        return
+    if registros is None or registros > total:
+        reconstruir_numeros()
+        return
+    with _bloqueo_numeracion(), open(NUMEROS_FILE, "r+b") as bm:
+        for _, p in _presupuestos_desde(registros):
+            if 1 <= p["numero_cliente"] <= MAX_NUMERO:
+                _escribir_bit(bm, p["numero_cliente"], True)
+    _numeros_sin_confirmar = True
+    confirmar_numeros()
+
+# Consultas
+# consultar() combina filtros sobre cualquier campo. Los filtros numéricos y de fecha
+# se evalúan sobre el registro binario sin decodificarlo; los de texto decodifican solo
+# su campo. Cuando hay un índice aplicable (cliente, palabras de producto, número) se
+# leen solo los registros candidatos en lugar de recorrer todo el archivo.
+
+_OFFSET_NUMERO = struct.calcsize(f"{MAX_CLIENTE}s i") - 4
+_OFFSET_FECHA = _OFFSET_NUMERO + 4
+_OFFSET_PRODUCTO = _OFFSET_FECHA + MAX_FECHA
+_OFFSET_CHAPA = _OFFSET_PRODUCTO + MAX_PRODUCTO
+_OFFSET_FLOATS = struct.calcsize(f"{MAX_CLIENTE}s i {MAX_FECHA}s {MAX_PRODUCTO}s {MAX_CHAPA}s 0f")
+
+def _lector_numerico(formato, offset):
+    campo = struct.Struct(formato)
+    return lambda buf, base: campo.unpack_from(buf, base + offset)[0]
+
+def _lector_fecha(buf, base):
+    """Fecha "dd/mm/aaaa" del registro como entero aaaammdd (0 si no es válida)."""
+    return _fecha_a_entero(buf[base + _OFFSET_FECHA:base + _OFFSET_FECHA + 10])
+
+def _lector_texto(offset, largo):
+    return lambda buf, base: normalizar_texto(buf[base + offset:base + offset + largo].rstrip(b"\0").decode())
+
+def _lector_palabras(buf, base):
+    """Las mismas palabras que guarda el índice de productos (producto y tipo de chapa)."""
+    producto = _lector_texto(_OFFSET_PRODUCTO, MAX_PRODUCTO)(buf, base)
+    return f"{producto} {_lector_texto(_OFFSET_CHAPA, MAX_CHAPA)(buf, base)}" if INDEXAR_TIPO_CHAPA else producto
+
+def _fecha_a_entero(fecha):
+    try:
+        return int(fecha[6:10]) * 10000 + int(fecha[3:5]) * 100 + int(fecha[0:2])
+    except ValueError:
+        return 0
+
+# campo -> (tipo, lector sobre el registro binario)
+CAMPOS_CONSULTA = {
+    "cliente": ("texto", _lector_texto(0, MAX_CLIENTE)),
+    "numero_cliente": ("entero", _lector_numerico("i", _OFFSET_NUMERO)),
+    "fecha": ("fecha", _lector_fecha),
+    "producto": ("texto", _lector_texto(_OFFSET_PRODUCTO, MAX_PRODUCTO)),
+    "tipo_chapa": ("texto", _lector_texto(_OFFSET_CHAPA, MAX_CHAPA)),
+    "palabras": ("texto", _lector_palabras),  # producto + tipo_chapa, resuelto con el índice de productos
+}
+for _i, _campo in enumerate(["espesor", "ancho", "largo", "precio_chapa", "precio_mano_obra", "ganancia", "precio_total"]):
+    CAMPOS_CONSULTA[_campo] = ("real", _lector_numerico("f", _OFFSET_FLOATS + 4 * _i))
+
+OPERADORES = {"==": operator.eq, "!=": operator.ne, "<": operator.lt, "<=": operator.le,
+              ">": operator.gt, ">=": operator.ge}
+AGREGACIONES = ("suma", "promedio", "min", "max", "cantidad")
+
+def _convertir_valor(tipo, valor):
+    """Lleva el valor del filtro a la misma representación que devuelve el lector."""
+    if tipo == "entero":
+        return int(valor)
+    if tipo == "real":
+        # Los importes se guardan como float de 32 bits: redondear igual para poder comparar
+        return struct.unpack("f", struct.pack("f", float(valor)))[0]
+    if tipo == "fecha":
+        if not validar_fecha(valor):
+            raise ValueError(f"Fecha no válida: {valor}")
+        return _fecha_a_entero(valor)
+    return normalizar_texto(str(valor))
+
+def _crear_filtro(campo, operador, valor):
+    """Devuelve (es_numerico, función(buf, base) -> bool) para un filtro."""
+    if campo not in CAMPOS_CONSULTA:
+        raise ValueError(f"Campo desconocido: {campo}")
+    tipo, lector = CAMPOS_CONSULTA[campo]
+    numerico = tipo != "texto"
+    if operador == "entre":
+        minimo, maximo = (_convertir_valor(tipo, v) for v in valor)
+        return numerico, lambda buf, base: minimo <= lector(buf, base) <= maximo
+    if operador in OPERADORES:
+        comparar, valor = OPERADORES[operador], _convertir_valor(tipo, valor)
+        return numerico, lambda buf, base: comparar(lector(buf, base), valor)
+    if tipo == "texto" and operador == "contiene":
+        palabras = set(tokenizar(valor))
+        return False, lambda buf, base: palabras <= set(tokenizar(lector(buf, base)))
+    if tipo == "texto" and operador == "prefijo":
+        prefijo = normalizar_texto(valor)
+        return False, lambda buf, base: lector(buf, base).startswith(prefijo)
+    raise ValueError(f"Operador {operador} no válido para {campo}")
+
+def _posiciones_candidatas(filtros):
+    """Posiciones que pueden cumplir los filtros según los índices (None si no hay índice
+    aplicable) y los números de filtro que el índice ya resuelve por completo."""
+    candidatas = []
+    resueltos = set()
+    for numero_filtro, (campo, operador, valor) in enumerate(filtros):
+        if campo == "cliente" and operador == "==":
+            entrada = indice_clientes.get(normalizar_texto(valor))
+            candidatas.append(entrada["posiciones"] if entrada else [])
+            resueltos.add(numero_filtro)
+        elif campo == "cliente" and operador == "prefijo":
+            clave = normalizar_texto(valor)
+            posiciones = []
+            i = bisect_left(claves_clientes, clave)
+            while i < len(claves_clientes) and claves_clientes[i].startswith(clave):
+                posiciones.extend(indice_clientes[claves_clientes[i]]["posiciones"])
+                i += 1
+            candidatas.append(sorted(posiciones))
+            resueltos.add(numero_filtro)
+        elif campo == "palabras" and operador == "contiene" and tokenizar(valor):
+            candidatas.append(buscar_posiciones_por_producto(valor))
+            resueltos.add(numero_filtro)
+        elif campo == "producto" and operador == "contiene" and tokenizar(valor):
+            candidatas.append(buscar_posiciones_por_producto(valor))
+            if not INDEXAR_TIPO_CHAPA:  # con tipo_chapa en el índice hay que verificar el producto
+                resueltos.add(numero_filtro)
+        elif campo == "numero_cliente" and operador == "==":
+            # El mapa de bits solo descarta el número si refleja todo presupuestos.dat
+            numero = int(valor)
+            if 1 <= numero <= MAX_NUMERO and numeros_al_dia() and not numero_en_uso(numero):
+                candidatas.append([])
+    if not candidatas:
+        return None, set()
+    return (_intersectar(candidatas) if all(candidatas) else []), resueltos
+
+def _recorrer_registros(posiciones):
+    """Genera (posición, buffer, offset) de cada registro, en bloques grandes o solo los indicados."""
+    confirmar_escrituras()
+    if not os.path.exists(FILE_NAME):
+        return
+    with open(FILE_NAME, "rb") as f:
+        if posiciones is not None:
+            for posicion in posiciones:
+                f.seek(posicion * PRESUPUESTO_SIZE)
+                data = f.read(PRESUPUESTO_SIZE)
+                if len(data) == PRESUPUESTO_SIZE:
+                    yield posicion, data, 0
+            return
+        posicion = 0
+        while True:
+            data = f.read(PRESUPUESTO_SIZE * REGISTROS_POR_BLOQUE)
+            for base in range(0, len(data) - PRESUPUESTO_SIZE + 1, PRESUPUESTO_SIZE):
+                yield posicion, data, base
+                posicion += 1
+            if len(data) < PRESUPUESTO_SIZE * REGISTROS_POR_BLOQUE:
+                break
+
+def consultar(filtros=(), orden=None, descendente=False, limite=None, desplazamiento=0, agregaciones=()):
+    """Busca presupuestos que cumplan todos los filtros.
+
+    filtros: lista de (campo, operador, valor). Operadores: ==, !=, <, <=, >, >=,
+    "entre" (valor = (mínimo, máximo)) y, para texto, "contiene" (todas las palabras)
+    y "prefijo". Las fechas van como "dd/mm/aaaa" y los textos no distinguen
+    mayúsculas ni acentos. El campo "palabras" junta producto y tipo de chapa, igual
+    que el índice de productos.
+    agregaciones: lista de (función, campo) con función en suma, promedio, min, max, cantidad.
+    Devuelve la página pedida en "data", la cantidad total en "total" y las agregaciones
+    en "agregados" (clave "función_campo").
+    """
+    try:
+        filtros = list(filtros)
+        compilados = [_crear_filtro(*filtro) for filtro in filtros]
+        for funcion, campo in agregaciones:
+            if (funcion not in AGREGACIONES or campo not in CAMPOS_CONSULTA
+                    or funcion in ("suma", "promedio") and CAMPOS_CONSULTA[campo][0] not in ("entero", "real")):
+                raise ValueError(f"Agregación no válida: {funcion}({campo})")
+        if orden is not None and orden not in CAMPOS_CONSULTA:
+            raise ValueError(f"Campo desconocido: {orden}")
+        candidatas, resueltos = _posiciones_candidatas(filtros)
+    except (ValueError, TypeError) as e:
+        return {"success": False, "error": str(e)}
+
+    # Primero los filtros numéricos, que no decodifican texto
+    compilados = [c for numero_filtro, c in enumerate(compilados) if numero_filtro not in resueltos]
+    compilados.sort(key=lambda c: not c[0])
+    condiciones = [funcion for _, funcion in compilados]
+    lector_orden = CAMPOS_CONSULTA[orden][1] if orden else None
+    lectores_agregados = [(f"{funcion}_{campo}", funcion, CAMPOS_CONSULTA[campo][1])
+                          for funcion, campo in agregaciones]
+    acumulados = {clave: [] for clave, _, _ in lectores_agregados}
+
+    coincidencias = []  # (clave de orden, posición)
+    for posicion, buf, base in _recorrer_registros(candidatas):
+        if all(condicion(buf, base) for condicion in condiciones):
+            coincidencias.append((lector_orden(buf, base) if lector_orden else posicion, posicion))
+            for clave, funcion, lector in lectores_agregados:
+                if funcion != "cantidad":
+                    acumulados[clave].append(lector(buf, base))
+
+    if orden:
+        coincidencias.sort(reverse=descendente)
+    fin = None if limite is None else desplazamiento + limite
+    pagina = [posicion for _, posicion in coincidencias[desplazamiento:fin]]
+
+    agregados = {}
+    for clave, funcion, _ in lectores_agregados:
+        valores = acumulados[clave]
+        if funcion == "cantidad":
+            agregados[clave] = len(coincidencias)
+        elif funcion == "suma":
+            agregados[clave] = sum(valores)
+        elif funcion == "promedio":
+            agregados[clave] = sum(valores) / len(valores) if valores else 0
+        else:
+            agregados[clave] = (min if funcion == "min" else max)(valores, default=None)
+            if CAMPOS_CONSULTA[clave.split("_", 1)[1]][0] == "fecha" and agregados[clave]:
+                fecha = agregados[clave]
+                agregados[clave] = f"{fecha % 100:02d}/{fecha // 100 % 100:02d}/{fecha // 10000}"
+    return {"success": True, "data": leer_presupuestos_en(pagina), "total": len(coincidencias),
+            "agregados": agregados}
+
 def buscar_por_cliente(nombre):
-    return [p for p in leer_presupuestos() if p["cliente"].lower() == nombre.lower()]
+    return consultar([("cliente", "==", nombre)]).get("data", [])
 
 def buscar_por_numero(numero):
-    return [p for p in leer_presupuestos() if p["numero_cliente"] == numero]
+    return consultar([("numero_cliente", "==", numero)]).get("data", [])
+
+def filtro_mes_y_año(mes, año):
+    return ("fecha", "entre", (f"01/{mes:02d}/{año}", f"31/{mes:02d}/{año}"))
 
 def buscar_por_mes_y_año(mes, año):
-    presupuestos = leer_presupuestos()
-    resultados = []
-    for p in presupuestos:
-        try:
-            fecha = datetime.strptime(p["fecha"], "%d/%m/%Y")
-            if fecha.month == mes and fecha.year == año:
-                resultados.append(p)
-        except ValueError:
-            continue
-    return {"success": True, "data": resultados}
+    return consultar([filtro_mes_y_año(mes, año)])
 
 def resumen_presupuestos():
-    presupuestos = leer_presupuestos()
-    total = sum(p["precio_total"] for p in presupuestos)
-    count = len(presupuestos)
+    total = sum(c["total"] for c in agregados_clientes.values())
+    count = sum(c["cantidad"] for c in agregados_clientes.values())
     return {
         "total_facturado": total,
         "presupuestos": count,
@@ -274,76 +1313,68 @@ def resumen_presupuestos():
     }
 
 def modificar_presupuesto(numero_cliente, nuevos_datos):
+    try:
+        nuevo_numero = int(nuevos_datos["numero_cliente"])
+    except (ValueError, TypeError) as e:
+        return {"success": False, "error": f"Error en los datos: {str(e)}"}
+    cambia_numero = nuevo_numero != numero_cliente
     presupuestos = leer_presupuestos()
-    found = False
-    with open(FILE_NAME, "wb") as f:
-        for p in presupuestos:
-            if p["numero_cliente"] == numero_cliente:
-                try:
-                    p["cliente"] = nuevos_datos["cliente"]
-                    p["numero_cliente"] = int(nuevos_datos["numero_cliente"])
-                    p["fecha"] = nuevos_datos["fecha"]
-                    p["producto"] = nuevos_datos["producto"]
-                    p["tipo_chapa"] = nuevos_datos["tipo_chapa"]
-                    p["espesor"] = float(nuevos_datos["espesor"])
-                    p["ancho"] = float(nuevos_datos["ancho"])
-                    p["largo"] = float(nuevos_datos["largo"])
-                    p["precio_chapa"] = float(nuevos_datos["precio_chapa"])
-                    p["precio_mano_obra"] = float(nuevos_datos["precio_mano_obra"])
-                    p["ganancia"] = float(nuevos_datos["ganancia"])
-                    chapas_x = ceil(p["ancho"] / CHAPA_ANCHO)
-                    chapas_y = ceil(p["largo"] / CHAPA_ALTO)
-                    total_chapas = chapas_x * chapas_y
-                    costo_base = (total_chapas * p["precio_chapa"]) + p["precio_mano_obra"]
-                    p["precio_total"] = costo_base * (1 + p["ganancia"] / 100)
-                    found = True
-                except (ValueError, TypeError) as e:
-                    return {"success": False, "error": f"Error en los datos: {str(e)}"}
-            cliente = p["cliente"].encode().ljust(MAX_CLIENTE, b"\0")
-            fecha = p["fecha"].encode().ljust(MAX_FECHA, b"\0")
-            producto = p["producto"].encode().ljust(MAX_PRODUCTO, b"\0")
-            tipo_chapa = p["tipo_chapa"].encode().ljust(MAX_CHAPA, b"\0")
-            f.write(struct.pack(PRESUPUESTO_STRUCT,
-                               cliente,
-                               p["numero_cliente"],
-                               fecha,
-                               producto,
-                               tipo_chapa,
-                               p["espesor"],
-                               p["ancho"],
-                               p["largo"],
-                               p["precio_chapa"],
-                               p["precio_mano_obra"],
-                               p["ganancia"],
-                               p["precio_total"]))
-    return {"success": True, "message": "Presupuesto modificado"} if found else {"success": False, "error": "Presupuesto no encontrado"}
+    modificados = []
+    for posicion, p in enumerate(presupuestos):
+        if p["numero_cliente"] == numero_cliente:
+            try:
+                anterior = dict(p)
+                p["cliente"] = nuevos_datos["cliente"]
+                p["numero_cliente"] = int(nuevos_datos["numero_cliente"])
+                p["fecha"] = nuevos_datos["fecha"]
+                p["producto"] = nuevos_datos["producto"]
+                p["tipo_chapa"] = nuevos_datos["tipo_chapa"]
+                p["espesor"] = float(nuevos_datos["espesor"])
+                p["ancho"] = float(nuevos_datos["ancho"])
+                p["largo"] = float(nuevos_datos["largo"])
+                p["precio_chapa"] = float(nuevos_datos["precio_chapa"])
+                p["precio_mano_obra"] = float(nuevos_datos["precio_mano_obra"])
+                p["ganancia"] = float(nuevos_datos["ganancia"])
+                chapas_x = ceil(p["ancho"] / CHAPA_ANCHO)
+                chapas_y = ceil(p["largo"] / CHAPA_ALTO)
+                total_chapas = chapas_x * chapas_y
+                costo_base = (total_chapas * p["precio_chapa"]) + p["precio_mano_obra"]
+                p["precio_total"] = costo_base * (1 + p["ganancia"] / 100)
+                modificados.append((posicion, anterior))
+            except (ValueError, TypeError) as e:
+                return {"success": False, "error": f"Error en los datos: {str(e)}"}
+    if not modificados:
+        return {"success": False, "error": "Presupuesto no encontrado"}
+    # La reserva va dentro de la reescritura: si el programa se corta, indices.sucio
+    # hace que numeros.dat se reconstruya en lugar de quedar con el número tomado
+    with reescritura_presupuestos():
+        if cambia_numero and not reservar_numero(nuevo_numero):
+            return {"success": False, "error": f"El número de cliente {nuevo_numero} ya existe o no es válido"}
+        with escritura_atomica(FILE_NAME) as f:
+            for p in presupuestos:
+                f.write(empaquetar_presupuesto(p))
+        for posicion, anterior in modificados:
+            desindexar_presupuesto(anterior, posicion)
+            indexar_presupuesto(desempaquetar_presupuesto(empaquetar_presupuesto(presupuestos[posicion])), posicion)
+        if cambia_numero:
+            liberar_numero(numero_cliente)
+    return {"success": True, "message": "Presupuesto modificado"}
 
 def eliminar_presupuesto(numero_cliente):
     presupuestos = leer_presupuestos()
-    found = False
-    with open(FILE_NAME, "wb") as f:
-        for p in presupuestos:
-            if p["numero_cliente"] == numero_cliente:
-                found = True
-                continue
-            cliente = p["cliente"].encode().ljust(MAX_CLIENTE, b"\0")
-            fecha = p["fecha"].encode().ljust(MAX_FECHA, b"\0")
-            producto = p["producto"].encode().ljust(MAX_PRODUCTO, b"\0")
-            tipo_chapa = p["tipo_chapa"].encode().ljust(MAX_CHAPA, b"\0")
-            f.write(struct.pack(PRESUPUESTO_STRUCT,
-                               cliente,
-                               p["numero_cliente"],
-                               fecha,
-                               producto,
-                               tipo_chapa,
-                               p["espesor"],
-                               p["ancho"],
-                               p["largo"],
-                               p["precio_chapa"],
-                               p["precio_mano_obra"],
-                               p["ganancia"],
-                               p["precio_total"]))
-    return {"success": True, "message": "Presupuesto eliminado"} if found else {"success": False, "error": "Presupuesto no encontrado"}
+    eliminados = [posicion for posicion, p in enumerate(presupuestos) if p["numero_cliente"] == numero_cliente]
+    if eliminados:
+        with reescritura_presupuestos():
+            with escritura_atomica(FILE_NAME) as f:
+                for p in presupuestos:
+                    if p["numero_cliente"] != numero_cliente:
+                        f.write(empaquetar_presupuesto(p))
+            # De atrás hacia adelante, para que cada corrimiento no afecte a los siguientes
+            for posicion in reversed(eliminados):
+                desindexar_presupuesto(presupuestos[posicion], posicion)
+                desplazar_indices(posicion)
+            liberar_numero(numero_cliente)
+    return {"success": True, "message": "Presupuesto eliminado"} if eliminados else {"success": False, "error": "Presupuesto no encontrado"}
 
 def exportar_excel():
     try:
@@ -366,6 +1397,151 @@ def exportar_excel():
     except Exception as e:
         return {"success": False, "error": f"Error al exportar: {str(e)}"}
 
+# Formato compacto
+
+def _fecha_a_ordinal(fecha):
+    try:
+        return datetime.strptime(fecha, "%d/%m/%Y").toordinal()
+    except ValueError:
+        return 0
+
+def _ordinal_a_fecha(ordinal):
+    return date.fromordinal(ordinal).strftime("%d/%m/%Y") if ordinal else ""
+
+def escribir_formato_compacto(presupuestos, ruta=COMPACT_FILE):
+    """Escribe los presupuestos en formato compacto, en bloques con CRC."""
+    ids = {}
+    for p in presupuestos:
+        ids.setdefault(p["cliente"], len(ids))
+        ids.setdefault(p["tipo_chapa"], len(ids))
+
+    diccionario = bytearray()
+    for texto in ids:
+        texto_bytes = texto.encode()
+        diccionario += COMPACT_STRING_STRUCT.pack(len(texto_bytes)) + texto_bytes
+
+    with escritura_atomica(ruta) as f:
+        f.write(COMPACT_HEADER_STRUCT.pack(COMPACT_MAGIC, COMPACT_VERSION, 0, len(presupuestos), len(ids)))
+        f.write(diccionario)
+        f.write(COMPACT_CRC_STRUCT.pack(zlib.crc32(diccionario)))
+        for inicio in range(0, len(presupuestos), REGISTROS_POR_BLOQUE):
+            bloque = presupuestos[inicio:inicio + REGISTROS_POR_BLOQUE]
+            datos = bytearray()
+            for p in bloque:
+                producto = p["producto"].encode()[:MAX_PRODUCTO]
+                datos += COMPACT_REGISTRO_STRUCT.pack(
+                    ids[p["cliente"]], p["numero_cliente"], _fecha_a_ordinal(p["fecha"]),
+                    ids[p["tipo_chapa"]], p["espesor"], p["ancho"], p["largo"], p["ganancia"],
+                    p["precio_chapa"], p["precio_mano_obra"], p["precio_total"], len(producto))
+                datos += producto
+            f.write(COMPACT_BLOQUE_STRUCT.pack(len(bloque), len(datos), zlib.crc32(datos)))
+            f.write(datos)
+
+def leer_formato_compacto(ruta=COMPACT_FILE):
+    """Lee un archivo en formato compacto. Lanza ValueError si está dañado o no es compatible."""
+    with open(ruta, "rb") as f:
+        cabecera = f.read(COMPACT_HEADER_STRUCT.size)
+        if len(cabecera) < COMPACT_HEADER_STRUCT.size:
+            raise ValueError("Archivo demasiado corto")
+        magic, version, _, total, cantidad_strings = COMPACT_HEADER_STRUCT.unpack(cabecera)
+        if magic != COMPACT_MAGIC:
+            raise ValueError("No es un archivo de presupuestos en formato compacto")
+        if version != COMPACT_VERSION:
+            raise ValueError(f"Versión de formato {version} no soportada")
+
+        diccionario = bytearray()
+        strings = []
+        for _ in range(cantidad_strings):
+            largo_bytes = f.read(COMPACT_STRING_STRUCT.size)
+            texto_bytes = f.read(largo_bytes[0]) if largo_bytes else b""
+            if not largo_bytes or len(texto_bytes) < largo_bytes[0]:
+                raise ValueError("Diccionario de strings incompleto")
+            diccionario += largo_bytes + texto_bytes
+            strings.append(texto_bytes)
+        crc = f.read(COMPACT_CRC_STRUCT.size)
+        if len(crc) < COMPACT_CRC_STRUCT.size or COMPACT_CRC_STRUCT.unpack(crc)[0] != zlib.crc32(diccionario):
+            raise ValueError("Diccionario de strings dañado (CRC)")
+        try:
+            strings = [texto.decode() for texto in strings]
+        except UnicodeDecodeError:
+            raise ValueError("Diccionario de strings dañado")
+
+        presupuestos = []
+        numero_bloque = 0
+        while len(presupuestos) < total:
+            numero_bloque += 1
+            cabecera = f.read(COMPACT_BLOQUE_STRUCT.size)
+            if len(cabecera) < COMPACT_BLOQUE_STRUCT.size:
+                raise ValueError(f"Bloque {numero_bloque} incompleto")
+            registros, largo, crc = COMPACT_BLOQUE_STRUCT.unpack(cabecera)
+            datos = f.read(largo)
+            if len(datos) < largo:
+                raise ValueError(f"Bloque {numero_bloque} incompleto")
+            if zlib.crc32(datos) != crc:
+                raise ValueError(f"Bloque {numero_bloque} dañado (CRC)")
+            offset = 0
+            try:
+                for _ in range(registros):
+                    (cliente_id, numero, ordinal, chapa_id, espesor, ancho, largo_cm, ganancia,
+                     precio_chapa, mano_obra, total_p, largo_producto) = COMPACT_REGISTRO_STRUCT.unpack_from(datos, offset)
+                    offset += COMPACT_REGISTRO_STRUCT.size
+                    producto = datos[offset:offset + largo_producto].decode()
+                    offset += largo_producto
+                    presupuestos.append({
+                        "cliente": strings[cliente_id],
+                        "numero_cliente": numero,
+                        "fecha": _ordinal_a_fecha(ordinal),
+                        "producto": producto,
+                        "tipo_chapa": strings[chapa_id],
+                        "espesor": espesor,
+                        "ancho": ancho,
+                        "largo": largo_cm,
+                        "precio_chapa": precio_chapa,
+                        "precio_mano_obra": mano_obra,
+                        "ganancia": ganancia,
+                        "precio_total": total_p
+                    })
+            except (struct.error, IndexError, UnicodeDecodeError, ValueError):
+                raise ValueError(f"Bloque {numero_bloque} con registros inválidos")
+            if offset != largo:
+                raise ValueError(f"Bloque {numero_bloque} con registros inválidos")
+        if len(presupuestos) != total:
+            raise ValueError("La cantidad de registros no coincide con la cabecera")
+    return presupuestos
+
+def convertir_a_compacto(origen=FILE_NAME, destino=COMPACT_FILE):
+    """Convierte presupuestos.dat (registros de tamaño fijo) al formato compacto."""
+    try:
+        escribir_formato_compacto(leer_presupuestos(origen), destino)
+        antes, despues = os.path.getsize(origen), os.path.getsize(destino)
+        return {"success": True, "message": f"Convertido a {destino}: {antes} -> {despues} bytes"}
+    except Exception as e:
+        return {"success": False, "error": f"Error al convertir: {str(e)}"}
+
+def convertir_a_legacy(origen=COMPACT_FILE, destino=FILE_NAME):
+    """Convierte un archivo en formato compacto a registros de tamaño fijo."""
+    try:
+        presupuestos = leer_formato_compacto(origen)
+        confirmar_escrituras()
+        if os.path.abspath(destino) == os.path.abspath(FILE_NAME):
+            with reescritura_presupuestos():
+                with escritura_atomica(destino) as f:
+                    for p in presupuestos:
+                        f.write(empaquetar_presupuesto(p))
+                reconstruir_indices()
+        else:
+            with escritura_atomica(destino) as f:
+                for p in presupuestos:
+                    f.write(empaquetar_presupuesto(p))
+        return {"success": True, "message": f"Convertido a {destino}: {len(presupuestos)} presupuestos"}
+    except Exception as e:
+        return {"success": False, "error": f"Error al convertir: {str(e)}"}
+
+# Recuperar archivos y cargar índices al iniciar el programa
+recuperar_archivos()
+cargar_indices()
+atexit.register(cerrar_archivos)
+
 class PresupuestoApp(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -414,11 +1590,14 @@ class PresupuestoApp(QMainWindow):
         else:
             QMessageBox.critical(self, "Error", "PIN incorrecto")
 
-    def clear_layout(self):
-        while self.layout.count():
-            item = self.layout.takeAt(0)
+    def clear_layout(self, layout=None):
+        layout = self.layout if layout is None else layout
+        while layout.count():
+            item = layout.takeAt(0)
             if item.widget():
                 item.widget().deleteLater()
+            elif item.layout():
+                self.clear_layout(item.layout())
 
     def create_menu(self):
         self.clear_layout()
@@ -432,6 +1611,8 @@ class PresupuestoApp(QMainWindow):
             ("Ver Presupuestos", self.view_presupuestos),
             ("Buscar por Cliente", self.search_cliente),
             ("Buscar por Número", self.search_numero),
+            ("Buscar por Producto", self.search_producto),
+            ("Búsqueda Avanzada", self.search_avanzada),
             ("Buscar por Fecha", self.search_fecha),
             ("Modificar Presupuesto", self.modify_form),
             ("Eliminar Presupuesto", self.delete_form),
@@ -472,6 +1653,7 @@ class PresupuestoApp(QMainWindow):
                 widget.addItems([item["tipo_chapa"] for item in stock])  # Actualizar con tipos de chapa del stock
             layout.addRow(QLabel(label + ":"), widget)
             self.entries[label] = widget
+        self.entries["Número"].setText(str(proximo_numero()))
 
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dialog.accept)
@@ -610,6 +1792,17 @@ class PresupuestoApp(QMainWindow):
         layout = QVBoxLayout()
         layout.addWidget(QLabel("Nombre del Cliente:"))
         entry = QLineEdit()
+        # Sugerencias mientras se escribe, desde el índice de clientes
+        modelo = QStringListModel()
+        completer = QCompleter(modelo, dialog)
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        entry.setCompleter(completer)
+
+        def actualizar_sugerencias(texto):
+            modelo.setStringList(sugerir_clientes(texto))
+            completer.complete()
+
+        entry.textEdited.connect(actualizar_sugerencias)
         layout.addWidget(entry)
         buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
         buttons.accepted.connect(dialog.accept)
@@ -622,8 +1815,7 @@ class PresupuestoApp(QMainWindow):
             if not nombre:
                 QMessageBox.warning(self, "Error", "Ingrese un nombre")
                 return
-            resultados = buscar_por_cliente(nombre)
-            self.show_results(resultados)
+            self.mostrar_consulta([("cliente", "==", nombre)])
 
     def search_numero(self):
         dialog = QDialog(self)
@@ -645,8 +1837,28 @@ class PresupuestoApp(QMainWindow):
             except ValueError:
                 QMessageBox.warning(self, "Error", "Ingrese un número válido")
                 return
-            resultados = buscar_por_numero(numero)
-            self.show_results(resultados)
+            self.mostrar_consulta([("numero_cliente", "==", numero)])
+
+    def search_producto(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Buscar por Producto")
+        dialog.setFixedSize(300, 150)
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel("Palabras (ej: portón baranda):"))
+        entry = QLineEdit()
+        layout.addWidget(entry)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addWidget(buttons)
+        dialog.setLayout(layout)
+
+        if dialog.exec_():
+            consulta = entry.text().strip()
+            if not tokenizar(consulta):
+                QMessageBox.warning(self, "Error", "Ingrese al menos una palabra")
+                return
+            self.mostrar_consulta([("palabras", "contiene", consulta)])
 
     def search_fecha(self):
         dialog = QDialog(self)
@@ -676,13 +1888,89 @@ class PresupuestoApp(QMainWindow):
         if dialog.exec_():
             mes = mes_combo.currentIndex() + 1
             año = int(año_combo.currentText())
-            result = buscar_por_mes_y_año(mes, año)
-            if not result["success"]:
-                QMessageBox.critical(self, "Error", result["error"])
-            else:
-                self.show_results(result["data"])
+            self.mostrar_consulta([filtro_mes_y_año(mes, año)])
 
-    def show_results(self, resultados):
+    def search_avanzada(self):
+        dialog = QDialog(self)
+        dialog.setWindowTitle("Búsqueda Avanzada")
+        dialog.setFixedSize(400, 450)
+        layout = QFormLayout()
+        cliente = QLineEdit()
+        producto = QLineEdit()
+        tipo_chapa = QComboBox()
+        tipo_chapa.addItems([""] + sorted({item["tipo_chapa"] for item in stock}))
+        espesor = QLineEdit()
+        desde = QLineEdit()
+        hasta = QLineEdit()
+        total_min = QLineEdit()
+        total_max = QLineEdit()
+        orden = QComboBox()
+        ordenes = [("Número", "numero_cliente", False), ("Fecha", "fecha", False),
+                   ("Total (mayor primero)", "precio_total", True), ("Cliente", "cliente", False)]
+        orden.addItems([texto for texto, _, _ in ordenes])
+        layout.addRow(QLabel("Cliente (empieza con):"), cliente)
+        layout.addRow(QLabel("Palabras del producto:"), producto)
+        layout.addRow(QLabel("Tipo de chapa:"), tipo_chapa)
+        layout.addRow(QLabel("Espesor (mm):"), espesor)
+        layout.addRow(QLabel("Desde (dd/mm/yyyy):"), desde)
+        layout.addRow(QLabel("Hasta (dd/mm/yyyy):"), hasta)
+        layout.addRow(QLabel("Total mínimo:"), total_min)
+        layout.addRow(QLabel("Total máximo:"), total_max)
+        layout.addRow(QLabel("Ordenar por:"), orden)
+        buttons = QDialogButtonBox(QDialogButtonBox.Ok | QDialogButtonBox.Cancel)
+        buttons.accepted.connect(dialog.accept)
+        buttons.rejected.connect(dialog.reject)
+        layout.addRow(buttons)
+        dialog.setLayout(layout)
+
+        if dialog.exec_():
+            filtros = []
+            if cliente.text().strip():
+                filtros.append(("cliente", "prefijo", cliente.text().strip()))
+            if producto.text().strip():
+                filtros.append(("palabras", "contiene", producto.text().strip()))
+            if tipo_chapa.currentText():
+                filtros.append(("tipo_chapa", "==", tipo_chapa.currentText()))
+            for entry, campo, operador in [(espesor, "espesor", "=="), (total_min, "precio_total", ">="),
+                                           (total_max, "precio_total", "<=")]:
+                if entry.text().strip():
+                    if not validar_ganancia(entry.text().strip()):
+                        QMessageBox.warning(self, "Error", f"Valor no válido: {entry.text()}")
+                        return
+                    filtros.append((campo, operador, float(entry.text().strip())))
+            for entry, operador in [(desde, ">="), (hasta, "<=")]:
+                if entry.text().strip():
+                    if not validar_fecha(entry.text().strip()):
+                        QMessageBox.warning(self, "Error", "Fecha debe ser dd/mm/yyyy")
+                        return
+                    filtros.append(("fecha", operador, entry.text().strip()))
+            _, campo_orden, descendente = ordenes[orden.currentIndex()]
+            self.mostrar_consulta(filtros, orden=campo_orden, descendente=descendente)
+
+    def mostrar_consulta(self, filtros, pagina=0, orden=None, descendente=False):
+        """Muestra una página de resultados de consultar(), con botones para moverse entre páginas."""
+        result = consultar(filtros, orden=orden, descendente=descendente, limite=TAMAÑO_PAGINA,
+                           desplazamiento=pagina * TAMAÑO_PAGINA, agregaciones=[("suma", "precio_total")])
+        if not result["success"]:
+            QMessageBox.critical(self, "Error", result["error"])
+            return
+        paginas = max(1, ceil(result["total"] / TAMAÑO_PAGINA))
+        navegacion = QHBoxLayout()
+        anterior_btn = QPushButton("Anterior")
+        anterior_btn.setEnabled(pagina > 0)
+        anterior_btn.clicked.connect(lambda: self.mostrar_consulta(filtros, pagina - 1, orden, descendente))
+        navegacion.addWidget(anterior_btn)
+        info = QLabel(f"Página {pagina + 1} de {paginas} - {result['total']} presupuestos, "
+                      f"total ${result['agregados']['suma_precio_total']:.2f}")
+        info.setAlignment(Qt.AlignCenter)
+        navegacion.addWidget(info)
+        siguiente_btn = QPushButton("Siguiente")
+        siguiente_btn.setEnabled(pagina + 1 < paginas)
+        siguiente_btn.clicked.connect(lambda: self.mostrar_consulta(filtros, pagina + 1, orden, descendente))
+        navegacion.addWidget(siguiente_btn)
+        self.show_results(result["data"], navegacion)
+
+    def show_results(self, resultados, navegacion=None):
         self.clear_layout()
         table = QTableWidget()
         table.setRowCount(len(resultados))
@@ -697,6 +1985,8 @@ class PresupuestoApp(QMainWindow):
             table.setItem(row, 4, QTableWidgetItem(p["tipo_chapa"]))
             table.setItem(row, 5, QTableWidgetItem(f"${p['precio_total']:.2f}"))
         self.layout.addWidget(table)
+        if navegacion is not None:
+            self.layout.addLayout(navegacion)
         back_btn = QPushButton("Volver")
         back_btn.clicked.connect(self.create_menu)
         self.layout.addWidget(back_btn)
@@ -738,10 +2028,66 @@ class PresupuestoApp(QMainWindow):
         """)
         texto.setAlignment(Qt.AlignCenter)
         self.layout.addWidget(texto)
+        if HAY_GRAFICOS:
+            rango_combo = QComboBox()
+            rango_combo.addItems(list(RANGOS_DASHBOARD))
+            rango_combo.currentTextChanged.connect(self.dibujar_graficos)
+            self.layout.addWidget(rango_combo, alignment=Qt.AlignCenter)
+            self.graficos = QGridLayout()
+            contenedor = QWidget()
+            contenedor.setLayout(self.graficos)
+            self.layout.addWidget(contenedor)
+            self.dibujar_graficos(rango_combo.currentText())
         back_btn = QPushButton("Volver")
         back_btn.clicked.connect(self.create_menu)
         self.layout.addWidget(back_btn)
 
+    def dibujar_graficos(self, rango):
+        while self.graficos.count():
+            item = self.graficos.takeAt(0)
+            if item.widget():
+                item.widget().deleteLater()
+        meses_atras = RANGOS_DASHBOARD[rango]
+        serie = reducir_serie(serie_mensual(meses_atras))
+        etiquetas = [s[0] for s in serie]
+        chapas = sorted(chapas_por_tipo(meses_atras).items())
+        clientes = top_clientes()
+        self.graficos.addWidget(self._grafico("Facturación mensual", etiquetas, [s[1] for s in serie]), 0, 0)
+        self.graficos.addWidget(self._grafico("Presupuestos por mes", etiquetas, [s[2] for s in serie],
+                                              linea=True), 0, 1)
+        self.graficos.addWidget(self._grafico("Chapas consumidas", [f"{t} {e} mm" for (t, e), _ in chapas],
+                                              [c for _, c in chapas]), 1, 0)
+        self.graficos.addWidget(self._grafico("Mejores clientes (histórico)", [c["nombre"] for c in clientes],
+                                              [c["total"] for c in clientes], horizontal=True), 1, 1)
+
+    def _grafico(self, titulo, categorias, valores, linea=False, horizontal=False):
+        chart = QChart()
+        chart.setTitle(titulo)
+        chart.legend().hide()
+        eje_categorias = QBarCategoryAxis()
+        eje_categorias.append(categorias)
+        eje_valores = QValueAxis()
+        eje_valores.setLabelFormat("%.0f")
+        eje_valores.setRange(0, max(valores, default=0) or 1)
+        if linea:
+            serie = QLineSeries()
+            for x, valor in enumerate(valores):
+                serie.append(x, valor)
+        else:
+            conjunto = QBarSet(titulo)
+            conjunto.append([float(v) for v in valores])
+            serie = QHorizontalBarSeries() if horizontal else QBarSeries()
+            serie.append(conjunto)
+        chart.addSeries(serie)
+        eje_x, eje_y = (eje_valores, eje_categorias) if horizontal else (eje_categorias, eje_valores)
+        chart.addAxis(eje_x, Qt.AlignBottom)
+        chart.addAxis(eje_y, Qt.AlignLeft)
+        serie.attachAxis(eje_x)
+        serie.attachAxis(eje_y)
+        vista = QChartView(chart)
+        vista.setRenderHint(QPainter.Antialiasing)
+        return vista
+
     def export_excel(self):
         result = exportar_excel()
         if result["success"]:
@@ -814,6 +2160,14 @@ class PresupuestoApp(QMainWindow):
         self.create_menu()
 
 if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] in ("--a-compacto", "--a-legacy"):
+        # Conversión entre formatos sin abrir la interfaz:
+        #   python presupuesto.py --a-compacto [origen.dat] [destino.pcf]
+        #   python presupuesto.py --a-legacy [origen.pcf] [destino.dat]
+        convertir = convertir_a_compacto if sys.argv[1] == "--a-compacto" else convertir_a_legacy
+        result = convertir(*sys.argv[2:4])
+        print(result["message"] if result["success"] else result["error"])
+        sys.exit(0 if result["success"] else 1)
     app = QApplication(sys.argv)
     window = PresupuestoApp()
     window.show()